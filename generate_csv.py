@@ -6,9 +6,20 @@ Creates a chronological view of all sentences with their first appearance date a
 
 import json
 import csv
+import gzip
 import sys
+from bisect import bisect_left
+from operator import itemgetter
 from pathlib import Path
 
+# orjson is optional; when installed it is used to parse the analysis file
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CSV_COLUMNS = ['first_appearance', 'total_days_active', 'num_periods', 'sentence']
+
 
 def generate_csv(json_file, output_csv=None):
     """
@@ -17,39 +28,45 @@ def generate_csv(json_file, output_csv=None):
     Args:
         json_file: Path to the analysis JSON file
         output_csv: Output CSV path (defaults to same name with .csv extension)
-    """
-    # Load the analysis data
-    with open(json_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
 
-    # Prepare data for CSV
+    Returns:
+        Tuple of (output path, list of row tuples in CSV_COLUMNS order)
+    """
+    # Load the analysis data (gzip-compressed if written with --compress)
+    if str(json_file).endswith('.gz'):
+        f = gzip.open(json_file, 'rt', encoding='utf-8')
+    else:
+        f = open(json_file, 'r', encoding='utf-8')
+    with f:
+        data = orjson.loads(f.read()) if orjson is not None else json.load(f)
+
+    # Prepare data for CSV as plain tuples, written directly by csv.writer
     rows = []
     for sent_data in data['sentences']:
         sentence = sent_data['sentence']
         total_days = sent_data['total_days']
         periods = sent_data['periods']
 
-        # Get the first appearance date (earliest start date across all periods)
+        # Get the first appearance date (the analyzer records periods in
+        # chronological order, so the first period starts earliest)
         if periods:
-            first_appearance = min(period['start'] for period in periods)
-            rows.append({
-                'first_appearance': first_appearance,
-                'total_days_active': total_days,
-                'num_periods': sent_data['total_occurrences'],
-                'sentence': sentence
-            })
+            first_appearance = periods[0]['start']
+            rows.append((first_appearance, total_days, sent_data['total_occurrences'], sentence))
 
     # Sort by first appearance date (chronological order)
-    rows.sort(key=lambda x: x['first_appearance'])
+    rows.sort(key=itemgetter(0))
 
     # Determine output filename
     if output_csv is None:
-        output_csv = Path(json_file).stem + '_chronological.csv'
+        source = Path(json_file)
+        if source.suffix == '.gz':
+            source = source.with_suffix('')
+        output_csv = source.stem + '_chronological.csv'
 
     # Write to CSV
     with open(output_csv, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=['first_appearance', 'total_days_active', 'num_periods', 'sentence'])
-        writer.writeheader()
+        writer = csv.writer(f)
+        writer.writerow(CSV_COLUMNS)
         writer.writerows(rows)
 
     return output_csv, rows
@@ -58,23 +75,28 @@ def generate_csv(json_file, output_csv=None):
 def print_summary(rows):
     """Print summary statistics of the CSV data."""
     total = len(rows)
-    active = [int(r['total_days_active']) for r in rows]
-    periods = [int(r['num_periods']) for r in rows]
+
+    # Sorted once: extremes, median and bucket sizes then come from indexing
+    # and binary search instead of separate passes over the list
+    active = sorted(int(days) for _, days, _, _ in rows)
+    reverted = bisect_left(active, 1)
+    short_lived = bisect_left(active, 100) - reverted
+    persistent = total - reverted - short_lived
 
     print("=" * 80)
     print("CSV EXPORT SUMMARY")
     print("=" * 80)
     print(f"Total sentences: {total}")
-    print(f"Date range: {rows[0]['first_appearance']} to {rows[-1]['first_appearance']}")
+    print(f"Date range: {rows[0][0]} to {rows[-1][0]}")
     print(f"\nDays active:")
-    print(f"  Average: {sum(active)/len(active):.1f} days")
-    print(f"  Median: {sorted(active)[len(active)//2]} days")
-    print(f"  Max: {max(active)} days")
-    print(f"  Min: {min(active)} days")
+    print(f"  Average: {sum(active)/total:.1f} days")
+    print(f"  Median: {active[total//2]} days")
+    print(f"  Max: {active[-1]} days")
+    print(f"  Min: {active[0]} days")
     print(f"\nDistribution:")
-    print(f"  0 days (immediately reverted): {sum(1 for d in active if d == 0)} ({sum(1 for d in active if d == 0)/total*100:.0f}%)")
-    print(f"  1-99 days: {sum(1 for d in active if 1 <= d < 100)} ({sum(1 for d in active if 1 <= d < 100)/total*100:.0f}%)")
-    print(f"  100+ days (persistent): {sum(1 for d in active if d >= 100)} ({sum(1 for d in active if d >= 100)/total*100:.0f}%)")
+    print(f"  0 days (immediately reverted): {reverted} ({reverted/total*100:.0f}%)")
+    print(f"  1-99 days: {short_lived} ({short_lived/total*100:.0f}%)")
+    print(f"  100+ days (persistent): {persistent} ({persistent/total*100:.0f}%)")
     print("=" * 80)
 
 
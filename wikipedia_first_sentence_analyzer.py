@@ -6,12 +6,88 @@ Uses intelligent caching to avoid refetching already-analyzed revisions.
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
+import html
+import unicodedata
 from datetime import datetime
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import json
+import gzip
+import zlib
 import time
+import threading
 import os
+import sys
+
+# orjson is optional; when installed it replaces json for (de)serialization
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Revisions fetched per API request; the limit for content queries by anonymous clients
+BATCH_SIZE = 50
+
+# Concurrent batch requests; kept small to stay within Wikipedia's API etiquette
+MAX_WORKERS = 4
+
+# Seconds to wait for a connection or response before a request is retried or fails
+REQUEST_TIMEOUT = 30
+
+# Minimum seconds between the start of two API requests, across all worker threads
+MIN_REQUEST_INTERVAL = 0.1
+
+# Days before the complete revision history is listed again instead of only newer
+# revisions, so revisions deleted from the history since are dropped
+HISTORY_REFRESH_DAYS = 30
+
+# Bumped whenever sentence extraction changes, so stale cached sentences are discarded
+CACHE_SCHEMA_VERSION = 5
+
+# Patterns used to reduce raw wikitext to plain text and find its first sentence.
+# Compiled once at import time since they run against every fetched revision.
+# None of them scans past the next delimiter of its own kind, and closing tags
+# are searched for by strip_elements, so broken markup costs linear time.
+_TEMPLATE_OPEN_RE = re.compile(r'\{\{')
+_TEMPLATE_TOKEN_RE = re.compile(r'(\}\})|\{\{')
+_FILE_OPEN_RE = re.compile(r'\[\[\s*(?:File|Image):', re.IGNORECASE)
+_LINK_TOKEN_RE = re.compile(r'(\]\])|\[\[')
+_NON_PROSE_TAGS = ('gallery', 'imagemap', 'math', 'chem', 'score', 'syntaxhighlight', 'timeline')
+_REF_OPEN_RE = re.compile(r'<(?P<name>ref)\b[^<>]*?(?P<empty>/?)>', re.IGNORECASE)
+_NON_PROSE_OPEN_RE = re.compile(
+    r'<(?P<name>' + '|'.join(_NON_PROSE_TAGS) + r')\b[^<>]*?(?P<empty>/?)>',
+    re.IGNORECASE
+)
+_CLOSING_TAG_RES = {
+    name: re.compile(f'</{name}>', re.IGNORECASE)
+    for name in ('ref',) + _NON_PROSE_TAGS
+}
+# Remaining inline markup is removed in a single pass: wiki and external links
+# (replaced by their display text), bold/italic quotes, magic words and tags.
+# A tag cannot contain '<', so a stray '<' in the prose is not taken as the
+# start of a tag running up to the next element.
+_MARKUP_RE = re.compile(
+    r'\[\[(?:[^|\]\[]*\|)?(?P<link>[^\]\[]+)\]\]'
+    r'|\[(?:https?:)?//[^\s\]\[]*(?:\s+(?P<extlink>[^\s\]\[][^\]\[]*)?)?\]'
+    r"|'{2,}|(?-i:__[A-Z]+__)|<[^<>]+>",
+    re.IGNORECASE
+)
+_WS_RE = re.compile(r'\s+')
+# One alternative per way the sentence can start; clean_sentence prefers them
+# in the order of _CLEAN_PRIORITY, not by position
+_CLEAN_RE = re.compile(r'''
+      (?P<is>The\ 27\ Club\ is)
+    | (?P<comma>The\ 27\ Club,)
+    | (?P<double>The\ "27\ Club")
+    | (?P<single>The\ '27\ Club')
+    | (?-i:(?P<prefix>^27\s+[Cc]lub))
+    | (?P<mention>the\ 27\ club)
+''', re.IGNORECASE | re.VERBOSE)
+_CLEAN_PRIORITY = ('is', 'comma', 'double', 'single', 'prefix', 'mention')
+_LEAD_RE = re.compile(r'(The 27 Club[^.!?]*[.!?])', re.IGNORECASE)
 
 def clean_sentence(sentence):
     """
@@ -21,239 +97,530 @@ def clean_sentence(sentence):
     if not sentence:
         return None
 
-    # Look for "The 27 Club is" or similar patterns
-    patterns = [
-        r'The 27 Club is',
-        r'The 27 Club,',
-        r'The "27 Club"',
-        r"The '27 Club'",
-    ]
+    # Record where each pattern first matches in a single scan
+    starts = {}
+    capitalized_mention = False
+    for match in _CLEAN_RE.finditer(sentence):
+        starts.setdefault(match.lastgroup, match.start())
+        if match.lastgroup == 'mention' and match.group()[1:] == 'he 27 Club':
+            capitalized_mention = True
+
+    # A bare mention only counts if "The 27 Club" or "the 27 Club" appears
+    # somewhere, but the sentence is cut at the first mention in any case
+    if not capitalized_mention:
+        starts.pop('mention', None)
+
+    for kind in _CLEAN_PRIORITY:
+        if kind in starts:
+            # Return everything from this point forward
+            return sentence[starts[kind]:].strip()
+
+    # Otherwise return as-is
+    return sentence.strip()
+
+def find_sentence_end(text):
+    """
+    Return the index just past the first '.', '!' or '?' that is followed by
+    whitespace or the end of the text, or None if there is no such terminator.
+
+    Uses str.find for each terminator instead of a lazy regex, so the scan runs
+    in C rather than stepping through the regex engine one character at a time.
+    """
+    best = None
+    for terminator in '.!?':
+        limit = len(text) if best is None else best
+        i = text.find(terminator, 0, limit)
+        while i >= 0:
+            if i + 1 == len(text) or text[i + 1].isspace():
+                best = i + 1
+                break
+            i = text.find(terminator, i + 1, limit)
+    return best
+
+def strip_comments(text):
+    """Remove HTML comments, leaving an unclosed one and everything after it."""
+    pieces = []
+    pos = 0
+
+    while True:
+        start = text.find('<!--', pos)
+        if start < 0:
+            break
+        end = text.find('-->', start + 4)
+        # No later comment can be closed either, so stop searching
+        if end < 0:
+            break
+        pieces.append(text[pos:start])
+        pos = end + 3
+
+    pieces.append(text[pos:])
+    return ''.join(pieces)
+
+def strip_balanced(text, opening_re, token_re):
+    """
+    Remove nested markup blocks such as templates or file links.
+
+    Delimiters are scanned once from left to right with a stack of the ones
+    still open, so unclosed blocks don't cause rescans to the end of the text.
+    A closed block is removed along with everything nested in it; a block
+    that is never closed loses just its opening delimiter.
+
+    Args:
+        text: Text to strip
+        opening_re: Pattern matching the start of a block to remove, tried
+            at each opening delimiter and one character into it
+        token_re: Pattern matching opening and closing delimiters, with
+            group 1 set only for closing delimiters
+    """
+    # One entry per open delimiter: its opening_re match, or None if it
+    # doesn't start a block to remove
+    stack = []
+    # (start, end) spans to cut out, in the order their blocks closed
+    removed = []
+
+    for token in token_re.finditer(text):
+        if not token.group(1):
+            # In an odd run such as "[[[File:" the block starts inside the
+            # delimiter, after the bracket the delimiter pairs up before it
+            start = token.start()
+            stack.append(opening_re.match(text, start) or opening_re.match(text, start + 1))
+        elif stack:
+            opening = stack.pop()
+            if opening:
+                # Blocks that closed inside this one are covered by its span
+                while removed and removed[-1][0] > opening.start():
+                    removed.pop()
+                removed.append((opening.start(), token.end()))
+
+    # Unbalanced markup: drop just the opening delimiter
+    removed.extend((opening.start(), opening.end()) for opening in stack if opening)
+    removed.sort()
+
+    pieces = []
+    pos = 0
+    for start, end in removed:
+        pieces.append(text[pos:start])
+        pos = end
+
+    pieces.append(text[pos:])
+    return ''.join(pieces)
+
+def strip_elements(text, opening_re):
+    """
+    Remove elements such as refs together with their content.
+
+    An element runs from its opening tag to the first matching closing tag.
+    Self-closing tags are removed on their own, and opening tags without a
+    closing tag are left for _MARKUP_RE to drop as plain tags.
+
+    Args:
+        text: Text to strip
+        opening_re: Pattern matching an opening tag, with the tag name in
+            group 'name' and the slash of a self-closing tag in group 'empty'
+    """
+    pieces = []
+    pos = 0
+    scan = 0
+    # Tags with no closing tag left in the rest of the text; later opening
+    # tags of the same name are not searched to the end again
+    unclosed = set()
+
+    while True:
+        opening = opening_re.search(text, scan)
+        if not opening:
+            break
+
+        name = opening.group('name').lower()
+        if opening.group('empty'):
+            end = opening.end()
+        else:
+            closing = None if name in unclosed else _CLOSING_TAG_RES[name].search(text, opening.end())
+            if not closing:
+                unclosed.add(name)
+                scan = opening.end()
+                continue
+            end = closing.end()
+
+        pieces.append(text[pos:opening.start()])
+        pos = scan = end
+
+    pieces.append(text[pos:])
+    return ''.join(pieces)
+
+def replace_markup(match):
+    """Replacement for _MARKUP_RE: a link's display text, otherwise nothing."""
+    label = match.group('link')
+    if label is None:
+        label = match.group('extlink')
+    if not label:
+        return ''
+    # Link labels may contain markup of their own
+    return _MARKUP_RE.sub(replace_markup, label)
+
+def extract_first_sentence(wikitext):
+    """Extract the cleaned first sentence from a revision's raw wikitext."""
+    if not wikitext:
+        return None
+
+    # Remove comments, templates (infoboxes, hatnotes) and images with captions
+    text = strip_comments(wikitext)
+    text = strip_balanced(text, _TEMPLATE_OPEN_RE, _TEMPLATE_TOKEN_RE)
+    text = strip_balanced(text, _FILE_OPEN_RE, _LINK_TOKEN_RE)
+
+    # Drop refs, and extension tags whose content is not prose (e.g. gallery
+    # file lines), along with their content before any other tags are touched
+    text = strip_elements(text, _REF_OPEN_RE)
+    text = strip_elements(text, _NON_PROSE_OPEN_RE)
+
+    # Replace links with their display text and drop remaining markup
+    text = _MARKUP_RE.sub(replace_markup, text)
+
+    # Decode all named and numeric HTML entities, then normalize compatibility
+    # characters so visually identical sentences compare equal
+    text = html.unescape(text)
+    text = unicodedata.normalize('NFKC', text)
 
-    for pattern in patterns:
-        match = re.search(pattern, sentence, re.IGNORECASE)
+    # Clean up whitespace
+    text = _WS_RE.sub(' ', text).strip()
+
+    # Skip any leftover text before the actual article text
+    if not text.startswith('The 27 Club') and not text.startswith('the 27 Club'):
+        match = _LEAD_RE.search(text)
         if match:
-            # Return everything from this point forward
-            return sentence[match.start():].strip()
+            # Start from "The 27 Club"
+            text = text[match.start():]
 
-    # If no match found, check if it starts with "27 Club" variants
-    if re.match(r'^27\s+[Cc]lub', sentence):
-        return sentence.strip()
+    # Extract first sentence
+    end = find_sentence_end(text)
 
-    # If it contains "The 27 Club" somewhere, extract from there
-    if 'The 27 Club' in sentence or 'the 27 Club' in sentence:
-        idx = sentence.lower().find('the 27 club')
-        if idx >= 0:
-            return sentence[idx:].strip()
+    if end is not None:
+        sentence = text[:end].strip()
+    else:
+        sentence = text[:500].strip() if text else None
 
-    # Otherwise return as-is
-    return sentence.strip()
+    # Clean the sentence to start with "The 27 Club"
+    return clean_sentence(sentence)
+
+def revision_cache_path(cache_file):
+    """Path of the append-only revision cache kept next to an analysis file."""
+    compressed = cache_file.endswith('.gz')
+    root = os.path.splitext(cache_file[:-3] if compressed else cache_file)[0]
+    return root + '_revisions.jsonl' + ('.gz' if compressed else '')
+
+def cache_line(revid, entry):
+    """Serialize one revision cache entry as a JSONL line."""
+    return dumps_json({'revid': revid, **entry}) + '\n'
+
+def write_revision_cache(path, cache):
+    """Rewrite the revision cache file from scratch, starting with its schema header."""
+    with open_json_file(path, 'w') as f:
+        f.write(dumps_json({'schema_version': CACHE_SCHEMA_VERSION}) + '\n')
+        f.writelines(cache_line(revid, entry) for revid, entry in cache.items())
 
 def load_cache(cache_file):
-    """Load previously analyzed revisions from cache file."""
-    if not os.path.exists(cache_file):
-        return {}
+    """
+    Load previously analyzed revisions from cache file.
 
-    try:
-        with open(cache_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        # Extract the revision cache
-        # Old format: just has 'sentences' array
-        # New format: has 'revision_cache' dict
-        if 'revision_cache' in data:
-            cache = data['revision_cache']
-        else:
-            # Migrate from old format - extract revision IDs from periods
-            cache = {}
-            if 'sentences' in data:
-                for sent_data in data['sentences']:
-                    for period in sent_data.get('periods', []):
-                        if 'revid' in period:
-                            revid = str(period['revid'])
-                            # Clean the sentence
-                            cleaned = clean_sentence(sent_data['sentence'])
-                            cache[revid] = {
-                                'timestamp': period['start'] + 'T00:00:00Z',
-                                'sentence': cleaned
-                            }
+    Analyzed revisions are kept in an append-only JSONL file next to the
+    analysis file (see revision_cache_path), one revision per line after a
+    schema header line. The analysis file itself provides the revision
+    metadata from the previous run.
 
-        print(f"Loaded cache with {len(cache)} previously analyzed revisions")
+    Returns:
+        Tuple of (revision cache dict, list of known revision metadata, date the
+        known revisions were last listed completely or None)
+    """
+    known_revisions = []
+    history_date = None
+    if os.path.exists(cache_file):
+        try:
+            with open_json_file(cache_file, 'r') as f:
+                data = loads_json(f.read())
+            # Revision metadata from the last run, used to list only newer revisions
+            # until it is due for a complete listing again
+            if data.get('history_date'):
+                history_date = datetime.strptime(data['history_date'], '%Y-%m-%d %H:%M:%S')
+                if (datetime.now() - history_date).days < HISTORY_REFRESH_DAYS:
+                    known_revisions = data.get('revision_history', [])
+                else:
+                    print(f"Revision history is over {HISTORY_REFRESH_DAYS} days old - listing it again")
+        except Exception as e:
+            print(f"Error loading analysis file: {e}")
+
+    path = revision_cache_path(cache_file)
+    if not os.path.exists(path):
+        return {}, known_revisions, history_date
 
-        # Clean up all cached sentences
-        cleaned_cache = {}
-        for revid, data in cache.items():
-            cleaned_sentence = clean_sentence(data['sentence'])
-            cleaned_cache[revid] = {
-                'timestamp': data['timestamp'],
-                'sentence': cleaned_sentence
-            }
+    try:
+        cache = {}
+        damaged = False
+        with open_json_file(path, 'r') as f:
+            header = loads_json(next(f, '{}'))
 
-        if len(cleaned_cache) != len(cache):
-            print(f"Cleaned {len(cache) - len(cleaned_cache)} invalid cache entries")
+            # Sentences extracted by an older version of the analyzer (including the
+            # HTML-based extraction) are not comparable with current ones
+            if header.get('schema_version') != CACHE_SCHEMA_VERSION:
+                print("Cache was created by an older version of the analyzer - re-analyzing all revisions")
+                return {}, known_revisions, history_date
 
-        return cleaned_cache
+            try:
+                for line in f:
+                    try:
+                        row = loads_json(line)
+                    except ValueError:
+                        # Partial line left by an interrupted run
+                        damaged = True
+                        continue
+                    # Sentences were cleaned when extracted, and the schema check above
+                    # guarantees the same extraction, so rows are used as stored. Most
+                    # revisions keep the previous sentence, so equal sentences are
+                    # interned to share one string object
+                    if row.get('sentence'):
+                        row['sentence'] = sys.intern(row['sentence'])
+                    cache[row.pop('revid')] = row
+            except (EOFError, zlib.error, gzip.BadGzipFile):
+                # Compressed cache whose last gzip member was cut off by an
+                # interrupted run; the rows read before it are kept
+                damaged = True
+
+        # Rewrite without the partial line so new entries are not appended onto it
+        if damaged:
+            write_revision_cache(path, cache)
+
+        print(f"Loaded cache with {len(cache)} previously analyzed revisions")
+        return cache, known_revisions, history_date
 
     except Exception as e:
-        print(f"Error loading cache: {e}")
-        return {}
+        # Keep the unreadable file rather than letting the new cache overwrite it
+        backup = path + '.damaged'
+        os.replace(path, backup)
+        print(f"Error loading cache: {e} - moved it to {backup}")
+        return {}, known_revisions, history_date
+
+def open_json_file(path, mode):
+    """Open a JSON file for text I/O, gzip-compressed when the path ends in .gz."""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+def loads_json(text):
+    """Parse a JSON document, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+def dumps_json(data, pretty=False):
+    """
+    Serialize data to a JSON string, with orjson when it is installed.
+    The stdlib fallback serializes in one json.dumps call, which uses the C
+    encoder when not pretty-printing (json.dump never does).
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else 0).decode('utf-8')
+    return json.dumps(data, indent=2 if pretty else None, ensure_ascii=False)
+
+def save_json(path, data, pretty=False):
+    """Write data to a JSON file in one shot."""
+    with open_json_file(path, 'w') as f:
+        f.write(dumps_json(data, pretty))
+
+def create_session():
+    """Create an HTTP session so all API requests share pooled keep-alive connections."""
+    session = requests.Session()
+    session.headers['User-Agent'] = 'WikipediaFirstSentenceAnalyzer/2.0 (Educational research tool with caching)'
+
+    # One pooled connection per worker thread. Connection errors and transient
+    # server errors are retried here; 429 and maxlag are handled by the callers
+    retries = Retry(total=3, backoff_factor=1, status_forcelist=[502, 503, 504], raise_on_status=False)
+    session.mount('https://', HTTPAdapter(pool_maxsize=MAX_WORKERS, max_retries=retries))
+    return session
+
+_throttle_lock = threading.Lock()
+_next_request_time = 0.0
+
+def wait_for_request_slot():
+    """Block until MIN_REQUEST_INTERVAL has passed since the previous request was started."""
+    global _next_request_time
+    with _throttle_lock:
+        now = time.monotonic()
+        wait_time = _next_request_time - now
+        _next_request_time = max(now, _next_request_time) + MIN_REQUEST_INTERVAL
+    if wait_time > 0:
+        time.sleep(wait_time)
+
+class APIError(Exception):
+    """Error response from the MediaWiki API."""
+
+    def __init__(self, code, info):
+        super().__init__(info)
+        self.code = code
+
+def iter_revisions(session, article_title, start_revid=None):
+    """
+    Yield revision metadata oldest first, one API page at a time.
 
-def get_all_revision_ids(article_title):
-    """Fetch all revision IDs and timestamps (lightweight query)."""
+    Only the revision ID, timestamp and SHA-1 are kept from each revision.
+    Starts at start_revid (inclusive) when given. Raises APIError on API
+    errors and requests/JSON exceptions on transport errors.
+    """
     base_url = "https://en.wikipedia.org/w/api.php"
-    revisions = []
-
-    headers = {
-        'User-Agent': 'WikipediaFirstSentenceAnalyzer/2.0 (Educational research tool with caching)'
-    }
 
     params = {
         'action': 'query',
         'titles': article_title,
         'prop': 'revisions',
-        'rvprop': 'timestamp|ids',
+        'rvprop': 'timestamp|ids|sha1',
         'rvlimit': 'max',
         'format': 'json',
         'rvdir': 'newer',
         'maxlag': '5'  # Required for non-interactive tasks per API:Etiquette
     }
 
-    print(f"Fetching complete revision history for '{article_title}'...")
+    if start_revid is not None:
+        params['rvstartid'] = start_revid
 
     while True:
-        response = requests.get(base_url, params=params, headers=headers)
+        wait_for_request_slot()
+        response = session.get(base_url, params=params, timeout=REQUEST_TIMEOUT)
 
         if response.status_code != 200:
-            print(f"Error: HTTP {response.status_code}")
-            return []
+            raise APIError('http', f"HTTP {response.status_code}")
 
-        try:
-            data = response.json()
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON: {e}")
-            return []
+        data = response.json()
+
+        if 'error' in data:
+            raise APIError(data['error'].get('code'), data['error'].get('info'))
 
         pages = data['query']['pages']
-        page_id = list(pages.keys())[0]
+        page_id = next(iter(pages))
 
         if page_id == '-1':
-            print(f"Error: Article '{article_title}' not found")
-            return []
-
-        page_revisions = pages[page_id].get('revisions', [])
-        revisions.extend(page_revisions)
+            raise APIError('missingtitle', f"Article '{article_title}' not found")
 
-        if len(revisions) % 500 == 0:
-            print(f"Fetched {len(revisions)} revision IDs...")
+        for rev in pages[page_id].get('revisions', []):
+            yield {key: rev[key] for key in ('revid', 'timestamp', 'sha1') if key in rev}
 
         if 'continue' in data:
             params['rvcontinue'] = data['continue']['rvcontinue']
         else:
             break
 
+def get_all_revision_ids(session, article_title, known_revisions=None):
+    """
+    Fetch all revision IDs and timestamps (lightweight query).
+
+    Revisions are immutable, so when the history from a previous run is
+    passed in as known_revisions only revisions newer than it are requested.
+    """
+    revisions = list(known_revisions or [])
+    known_revids = {rev['revid'] for rev in revisions}
+
+    if revisions:
+        # rvstartid is inclusive; the known revision is filtered out below
+        start_revid = revisions[-1]['revid']
+        print(f"Fetching revisions of '{article_title}' newer than {start_revid}...")
+    else:
+        start_revid = None
+        print(f"Fetching complete revision history for '{article_title}'...")
+
+    try:
+        for rev in iter_revisions(session, article_title, start_revid):
+            if rev['revid'] in known_revids:
+                continue
+            revisions.append(rev)
+            if len(revisions) % 500 == 0:
+                print(f"Fetched {len(revisions)} revision IDs...")
+    except APIError as e:
+        if known_revisions and e.code not in ('maxlag', 'http', 'missingtitle'):
+            # The last known revision may have been deleted since the previous run
+            print(f"Error: {e} - refetching complete history")
+            return get_all_revision_ids(session, article_title)
+        print(f"Error: {e}")
+        return []
+    except (requests.RequestException, ValueError) as e:
+        print(f"Error: {e}")
+        return []
+
     print(f"Total revisions in article: {len(revisions)}")
     return revisions
 
-def get_first_sentence_from_revision(revid, retry_count=0):
-    """Get the first sentence from a specific revision using the parse API."""
-    base_url = "https://en.wikipedia.org/w/api.php"
+def get_first_sentences_batch(session, revids, retry_count=0):
+    """
+    Get the first sentences of up to BATCH_SIZE revisions in one API request.
 
-    headers = {
-        'User-Agent': 'WikipediaFirstSentenceAnalyzer/2.0 (Educational research tool with caching)'
-    }
+    Returns:
+        Dict mapping revid to first sentence (None when the revision has no
+        usable content), or None if the request failed
+    """
+    base_url = "https://en.wikipedia.org/w/api.php"
 
     params = {
-        'action': 'parse',
-        'oldid': revid,
-        'prop': 'text',
-        'section': 0,
+        'action': 'query',
+        'prop': 'revisions',
+        'revids': '|'.join(str(revid) for revid in revids),
+        'rvprop': 'ids|content',
+        'rvslots': 'main',
+        'rvsection': 0,  # Lead section only; the first sentence is always in it
         'format': 'json',
-        'disabletoc': 1,
+        'formatversion': 2,  # Pages as a list and content under a plain 'content' key
         'maxlag': '5'  # Required for non-interactive tasks per API:Etiquette
     }
 
-    response = requests.get(base_url, params=params, headers=headers)
+    sentences = {revid: None for revid in revids}
 
-    # Handle rate limiting with exponential backoff
-    if response.status_code == 429:
-        if retry_count < 3:
-            wait_time = (2 ** retry_count) * 5  # 5s, 10s, 20s
-            print(f"  Rate limited, waiting {wait_time}s before retry...")
-            time.sleep(wait_time)
-            return get_first_sentence_from_revision(revid, retry_count + 1)
-        else:
-            print(f"  Failed after {retry_count} retries for revision {revid}")
+    # Large batches may be split across several responses by the API's result size limit
+    while True:
+        wait_for_request_slot()
+        try:
+            response = session.get(base_url, params=params, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException:
             return None
 
-    if response.status_code != 200:
-        return None
+        # Handle rate limiting with exponential backoff
+        if response.status_code == 429:
+            if retry_count < 3:
+                wait_time = (2 ** retry_count) * 5  # 5s, 10s, 20s
+                print(f"  Rate limited, waiting {wait_time}s before retry...")
+                time.sleep(wait_time)
+                return get_first_sentences_batch(session, revids, retry_count + 1)
+            else:
+                print(f"  Failed after {retry_count} retries for revisions {revids[0]}-{revids[-1]}")
+                return None
 
-    try:
-        data = response.json()
-    except json.JSONDecodeError:
-        return None
-
-    # Handle maxlag error - Wikipedia is too busy
-    if 'error' in data and data['error'].get('code') == 'maxlag':
-        if retry_count < 3:
-            wait_time = (2 ** retry_count) * 5  # 5s, 10s, 20s
-            print(f"  Server busy (maxlag), waiting {wait_time}s before retry...")
-            time.sleep(wait_time)
-            return get_first_sentence_from_revision(revid, retry_count + 1)
-        else:
-            print(f"  Server too busy after {retry_count} retries for revision {revid}")
+        if response.status_code != 200:
             return None
 
-    if 'parse' not in data or 'text' not in data['parse']:
-        return None
-
-    html_content = data['parse']['text']['*']
-
-    # Remove image/file references and their captions first
-    html_content = re.sub(r'<div[^>]*class="[^"]*thumb[^"]*"[^>]*>.*?</div>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
-
-    # Extract plain text from HTML
-    text = re.sub(r'<script[^>]*>.*?</script>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
-    text = re.sub(r'<style[^>]*>.*?</style>', '', text, flags=re.DOTALL | re.IGNORECASE)
-
-    # Remove any remaining File: or Image: references
-    text = re.sub(r'File:[^\s]+\.(jpg|png|gif|jpeg|svg)[^.!?]*', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'Image:[^\s]+\.(jpg|png|gif|jpeg|svg)[^.!?]*', '', text, flags=re.IGNORECASE)
-
-    # Strip HTML tags
-    text = re.sub(r'<[^>]+>', '', text)
-
-    # Decode HTML entities
-    text = text.replace('&nbsp;', ' ')
-    text = text.replace('&amp;', '&')
-    text = text.replace('&lt;', '<')
-    text = text.replace('&gt;', '>')
-    text = text.replace('&quot;', '"')
-    text = text.replace('&#91;', '[')
-    text = text.replace('&#93;', ']')
-
-    # Clean up whitespace
-    text = re.sub(r'\s+', ' ', text).strip()
+        try:
+            data = response.json()
+        except json.JSONDecodeError:
+            return None
 
-    # Remove any leading image captions or metadata
-    # Look for patterns like "Musicians and artists who died at age 27" followed by actual text
-    if not text.startswith('The 27 Club') and not text.startswith('the 27 Club'):
-        # Try to find where the actual article text starts
-        match = re.search(r'(The 27 Club[^.!?]*[.!?])', text, re.IGNORECASE)
-        if match:
-            # Start from "The 27 Club"
-            start_idx = match.start()
-            text = text[start_idx:]
+        # Handle maxlag error - Wikipedia is too busy
+        if 'error' in data and data['error'].get('code') == 'maxlag':
+            if retry_count < 3:
+                wait_time = (2 ** retry_count) * 5  # 5s, 10s, 20s
+                print(f"  Server busy (maxlag), waiting {wait_time}s before retry...")
+                time.sleep(wait_time)
+                return get_first_sentences_batch(session, revids, retry_count + 1)
+            else:
+                print(f"  Server too busy after {retry_count} retries for revisions {revids[0]}-{revids[-1]}")
+                return None
+
+        if 'query' not in data:
+            return None
 
-    # Extract first sentence
-    match = re.search(r'^(.*?[.!?])(?:\s|$)', text)
+        # Deleted or suppressed revisions come back without content and keep None
+        for page in data['query'].get('pages', []):
+            for rev in page.get('revisions', []):
+                wikitext = rev.get('slots', {}).get('main', {}).get('content')
+                sentences[rev['revid']] = extract_first_sentence(wikitext)
 
-    if match:
-        sentence = match.group(1).strip()
-    else:
-        sentence = text[:500].strip() if text else None
+        if 'continue' in data:
+            params.update(data['continue'])
+        else:
+            break
 
-    # Clean the sentence to start with "The 27 Club"
-    return clean_sentence(sentence)
+    return sentences
 
 def analyze_with_cache(article_title, cache_file, test_mode=False, test_sample_rate=100):
     """
@@ -267,129 +634,159 @@ def analyze_with_cache(article_title, cache_file, test_mode=False, test_sample_r
         test_sample_rate: Sample rate when in test mode (default: 100)
     """
     # Load existing cache
-    cache = load_cache(cache_file)
+    cache, known_revisions, history_date = load_cache(cache_file)
+
+    session = create_session()
 
     # Get all revision IDs from Wikipedia
-    all_revisions = get_all_revision_ids(article_title)
+    all_revisions = get_all_revision_ids(session, article_title, known_revisions)
+    if not known_revisions:
+        history_date = datetime.now()
 
     if not all_revisions:
         return
 
-    # Determine which revisions need to be fetched
+    # Determine which revisions need to be fetched; filtering the revision list
+    # keeps them in chronological order along with their timestamps
     cached_revids = set(cache.keys())
-    all_revids = {str(rev['revid']) for rev in all_revisions}
-
-    new_revids = all_revids - cached_revids
+    new_revs = [rev for rev in all_revisions if str(rev['revid']) not in cached_revids]
 
     # Apply test mode sampling if enabled
-    if test_mode and len(new_revids) > test_sample_rate:
-        new_revids_sorted = sorted([int(r) for r in new_revids])
-        sampled_revids = [str(new_revids_sorted[i]) for i in range(0, len(new_revids_sorted), test_sample_rate)]
-        new_revids = set(sampled_revids)
+    if test_mode and len(new_revs) > test_sample_rate:
+        sampled_revs = new_revs[::test_sample_rate]
+        # Always include the newest revision so the current sentence is represented;
+        # checked by index rather than by searching the sampled list
+        if (len(new_revs) - 1) % test_sample_rate != 0:
+            sampled_revs.append(new_revs[-1])
+        new_revs = sampled_revs
         print(f"\nTest mode enabled: sampling every {test_sample_rate}th revision")
 
+    # Revisions with identical content (usually reverts) share a SHA-1, so only
+    # the first revision with each hash is fetched and the others reuse its sentence
+    sha1_to_revid = {}
+    for rev in all_revisions:
+        if rev.get('sha1') and str(rev['revid']) in cached_revids:
+            sha1_to_revid.setdefault(rev['sha1'], str(rev['revid']))
+
+    revs_to_fetch = []
+    duplicates = []
+    for rev in new_revs:
+        sha1 = rev.get('sha1')
+        if sha1 in sha1_to_revid:
+            duplicates.append((rev, sha1_to_revid[sha1]))
+        else:
+            if sha1:
+                sha1_to_revid[sha1] = str(rev['revid'])
+            revs_to_fetch.append(rev)
+
     print(f"\nCache statistics:")
     print(f"  Total revisions: {len(all_revisions)}")
     print(f"  Already cached: {len(cached_revids)}")
-    print(f"  New to analyze: {len(new_revids)}")
+    print(f"  Identical to another revision: {len(duplicates)}")
+    print(f"  New to analyze: {len(revs_to_fetch)}")
     if test_mode:
         print(f"  (Test mode: sampled from larger set)")
 
-    # Create revision lookup
-    revid_to_timestamp = {str(rev['revid']): rev['timestamp'] for rev in all_revisions}
-
-    # Fetch new revisions
-    if new_revids:
-        print(f"\nFetching {len(new_revids)} new revisions...")
-        print(f"Estimated time: ~{len(new_revids) * 0.1 / 60:.1f} minutes")
-        new_revids_list = sorted([int(r) for r in new_revids])
-
-        for i, revid in enumerate(new_revids_list):
-            if (i + 1) % 50 == 0:
-                print(f"  Analyzed {i + 1}/{len(new_revids_list)} new revisions...")
-
-                # Save cache checkpoint every 50 revisions
-                if (i + 1) % 100 == 0:
-                    checkpoint_data = {
-                        'article': article_title,
-                        'analysis_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                        'revision_cache': cache,
-                        'note': 'Checkpoint save - analysis in progress'
-                    }
-                    with open(cache_file, 'w', encoding='utf-8') as f:
-                        json.dump(checkpoint_data, f, indent=2, ensure_ascii=False)
-                    print(f"  Checkpoint saved ({len(cache)} revisions cached)")
-
-            timestamp = revid_to_timestamp.get(str(revid))
-            if not timestamp:
-                continue
-
-            sentence = get_first_sentence_from_revision(revid)
-
-            cache[str(revid)] = {
-                'timestamp': timestamp,
-                'sentence': sentence
-            }
-
-            # Rate limiting - 10 req/sec is reasonable with maxlag protection
-            time.sleep(0.1)
-
-        print(f"  Completed analysis of {len(new_revids_list)} new revisions")
-    else:
-        print("\nNo new revisions to fetch - using cached data only")
+    # Analyzed revisions are appended to the JSONL cache as each batch completes,
+    # so an interrupted run keeps everything fetched so far
+    cache_path = revision_cache_path(cache_file)
+    if not cache:
+        write_revision_cache(cache_path, cache)
+
+    with open_json_file(cache_path, 'a') as cache_out:
+        # Fetch new revisions
+        if revs_to_fetch:
+            batches = [revs_to_fetch[i:i + BATCH_SIZE] for i in range(0, len(revs_to_fetch), BATCH_SIZE)]
+            print(f"\nFetching {len(revs_to_fetch)} new revisions in {len(batches)} batches...")
+            print(f"Estimated time: ~{len(batches) * 1.0 / MAX_WORKERS / 60:.1f} minutes")
+
+            # Batches are fetched concurrently; map() yields results in batch order,
+            # so the cache is only ever updated from this thread
+            analyzed = 0
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                results = executor.map(
+                    lambda batch: get_first_sentences_batch(session, [rev['revid'] for rev in batch]),
+                    batches
+                )
+
+                for batch, sentences in zip(batches, results):
+                    # Leave failed batches uncached so the next run retries them
+                    if sentences is None:
+                        print(f"  Failed to fetch revisions {batch[0]['revid']}-{batch[-1]['revid']}, skipping")
+                        continue
+
+                    for rev in batch:
+                        revid_str = str(rev['revid'])
+                        sentence = sentences[rev['revid']]
+                        cache[revid_str] = {
+                            'timestamp': rev['timestamp'],
+                            'sentence': sys.intern(sentence) if sentence else sentence
+                        }
+                        cache_out.write(cache_line(revid_str, cache[revid_str]))
+
+                    cache_out.flush()
+                    analyzed += len(batch)
+                    print(f"  Analyzed {analyzed}/{len(revs_to_fetch)} new revisions...")
+
+            print(f"  Completed analysis of {analyzed} new revisions")
+        else:
+            print("\nNo new revisions to fetch - using cached data only")
+
+        # Fill in revisions whose content matched a fetched or cached revision
+        for rev, source_revid in duplicates:
+            if source_revid in cache:
+                revid_str = str(rev['revid'])
+                cache[revid_str] = {
+                    'timestamp': rev['timestamp'],
+                    'sentence': cache[source_revid]['sentence']
+                }
+                cache_out.write(cache_line(revid_str, cache[revid_str]))
 
     # Build chronological timeline from cache
     print("\nBuilding timeline from complete revision history...")
     timeline = []
 
-    for revid_str in sorted(cache.keys(), key=lambda x: revid_to_timestamp.get(x, '')):
-        data = cache[revid_str]
-        if data['sentence']:  # Only include revisions with valid sentences
+    # The revision list is already in chronological order (rvdir=newer), so walking
+    # it avoids sorting the cache; cached revisions no longer listed are left out
+    for rev in all_revisions:
+        revid_str = str(rev['revid'])
+        data = cache.get(revid_str)
+        if data and data['sentence']:  # Only include revisions with valid sentences
             try:
-                timestamp = datetime.strptime(data['timestamp'], '%Y-%m-%dT%H:%M:%SZ')
+                # fromisoformat is implemented in C; strptime re-parses its format string.
+                # The trailing Z is dropped to keep naive datetimes like datetime.now()
+                timestamp = datetime.fromisoformat(data['timestamp'].rstrip('Z'))
                 timeline.append({
                     'revid': revid_str,
                     'timestamp': timestamp,
                     'sentence': data['sentence']
                 })
-            except:
+            except ValueError:
                 pass
 
     print(f"Timeline contains {len(timeline)} revisions with valid sentences")
 
-    # Calculate durations
-    sentence_durations = []
-    last_sentence = None
-    last_timestamp = None
-
-    for i, item in enumerate(timeline):
-        current_sentence = item['sentence']
-        current_timestamp = item['timestamp']
-
-        # Record when sentence changes
-        if current_sentence != last_sentence:
-            if last_sentence is not None:
-                # Calculate duration of previous sentence
-                duration_days = (current_timestamp - last_timestamp).days
-                sentence_durations.append({
-                    'sentence': last_sentence,
-                    'start_date': last_timestamp,
-                    'end_date': current_timestamp,
-                    'days': duration_days
-                })
-
-            last_sentence = current_sentence
-            last_timestamp = current_timestamp
-
-    # Add final sentence period (to now)
-    if last_sentence is not None:
-        duration_days = (datetime.now() - last_timestamp).days
-        sentence_durations.append({
-            'sentence': last_sentence,
-            'start_date': last_timestamp,
-            'end_date': datetime.now(),
-            'days': duration_days
-        })
+    # Calculate durations: find the revisions where the sentence changed, then
+    # fill a pre-sized list with one period per change, each ending at the next.
+    # Cached sentences are interned, so unchanged sentences compare by identity
+    # and later dict lookups reuse the cached hash
+    changes = [
+        i for i, item in enumerate(timeline)
+        if i == 0 or item['sentence'] != timeline[i - 1]['sentence']
+    ]
+    now = datetime.now()
+    sentence_durations = [None] * len(changes)
+
+    for n, i in enumerate(changes):
+        start_timestamp = timeline[i]['timestamp']
+        # The final sentence is still active, so its period runs until now
+        end_timestamp = timeline[changes[n + 1]]['timestamp'] if n + 1 < len(changes) else now
+        sentence_durations[n] = {
+            'sentence': timeline[i]['sentence'],
+            'start_date': start_timestamp,
+            'end_date': end_timestamp,
+            'days': (end_timestamp - start_timestamp).days
+        }
 
     print(f"Detected {len(sentence_durations)} distinct sentence change periods")
 
@@ -399,13 +796,15 @@ def analyze_with_cache(article_title, cache_file, test_mode=False, test_sample_r
     for period in sentence_durations:
         sentence = period['sentence']
         if sentence:
-            unique_sentences[sentence]['days'] += period['days']
-            unique_sentences[sentence]['occurrences'].append({
-                'start': period['start_date'].strftime('%Y-%m-%d'),
-                'end': period['end_date'].strftime('%Y-%m-%d'),
+            # One hash lookup per period instead of one per field update
+            entry = unique_sentences[sentence]
+            entry['days'] += period['days']
+            entry['occurrences'].append({
+                'start': period['start_date'].date().isoformat(),
+                'end': period['end_date'].date().isoformat(),
                 'days': period['days']
             })
-            unique_sentences[sentence]['total_occurrences'] += 1
+            entry['total_occurrences'] += 1
 
     # Sort by total days
     sorted_sentences = sorted(unique_sentences.items(), key=lambda x: x[1]['days'], reverse=True)
@@ -440,7 +839,9 @@ def analyze_with_cache(article_title, cache_file, test_mode=False, test_sample_r
         'cached_revisions': len(cache),
         'revisions_with_sentences': len(timeline),
         'unique_sentences': len(sorted_sentences),
-        'revision_cache': cache,  # Store the cache for next run
+        'schema_version': CACHE_SCHEMA_VERSION,
+        'history_date': history_date.strftime('%Y-%m-%d %H:%M:%S'),
+        'revision_history': all_revisions,
         'sentences': [
             {
                 'sentence': sentence,
@@ -452,17 +853,14 @@ def analyze_with_cache(article_title, cache_file, test_mode=False, test_sample_r
         ]
     }
 
-    with open(cache_file, 'w', encoding='utf-8') as f:
-        json.dump(output, f, indent=2, ensure_ascii=False)
+    save_json(cache_file, output, pretty=True)
 
     print(f"\n{'='*80}")
     print(f"Results saved to: {cache_file}")
-    print(f"Cache updated with {len(cache)} analyzed revisions")
+    print(f"Revision cache: {cache_path} ({len(cache)} analyzed revisions)")
     print("="*80)
 
 if __name__ == "__main__":
-    import sys
-
     article_title = "27 Club"
     cache_file = f"{article_title.replace(' ', '_')}_first_sentence_analysis.json"
 
@@ -470,6 +868,10 @@ if __name__ == "__main__":
     test_mode = '--test' in sys.argv or '-t' in sys.argv
     full_mode = '--full' in sys.argv or '-f' in sys.argv
 
+    # Store the analysis gzip-compressed
+    if '--compress' in sys.argv or '-z' in sys.argv:
+        cache_file += '.gz'
+
     if test_mode:
         print("="*80)
         print("RUNNING IN TEST MODE - sampling every 100th revision")
@@ -478,7 +880,7 @@ if __name__ == "__main__":
     elif full_mode:
         print("="*80)
         print("RUNNING IN FULL MODE - analyzing all revisions")
-        print("This will take approximately 8-10 minutes")
+        print("This will take a few minutes")
         print("="*80)
         analyze_with_cache(article_title, cache_file, test_mode=False)
     else: